@@ -1,81 +1,132 @@
 import argparse
+import errno
 import os
+import queue
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import re
-from datetime import datetime
 import shutil
+import sys
+import time
 
-args = argparse.ArgumentParser(description='Resolve Syncthing conflict files by keeping the most recent version.')
-args.add_argument('path', help='Path to search for conflict files')
-args.add_argument('--dry-run', action='store_true', help='Show what would be done without making any changes')
-args.add_argument('--backup-dir', help='Directory to move older conflict files to (if not provided, older conflicts will be deleted)')
-args = args.parse_args()
-
-conflict_item = namedtuple('Conflict', ['conflict_path', 'file_path', 'timestamp'])
+# namedtuple instances carry no per-instance __dict__, so they stay small even for large trees
+conflict_item = namedtuple('Conflict', ['conflict_path', 'file_path', 'ts_key'])
 
 # Constants for action types
 ACTION_KEEP = 'keep'
 ACTION_DELETE = 'delete'
 ACTION_BACKUP = 'backup'
 
-def main():
-    re_conflict = re.compile(r'^.+\.sync-conflict-.+')
-    re_timestamp = re.compile(r'sync-conflict-(\d{8})-(\d{6})-[A-Z0-9]+')
-    # Walk provided path, get all files matching "\.sync-conflict-.*"
+# Matches conflict file names (e.g., file.sync-conflict-YYYYMMDD-HHMMSS-DEVICE.txt), capturing the
+# original base name, the conflict date and time, and the extension following the device identifier
+RE_CONFLICT = re.compile(r'(?P<base>.+?)\.sync-conflict-(?P<date>\d{8})-(?P<time>\d{6})-[A-Z0-9]+(?:\.(?P<ext>.+))?')
+
+def fmt_ts(ts_key):
+    # Format a YYYYMMDDHHMMSS key as "YYYY-MM-DD HH:MM:SS" without building a datetime
+    return f"{ts_key[0:4]}-{ts_key[4:6]}-{ts_key[6:8]} {ts_key[8:10]}:{ts_key[10:12]}:{ts_key[12:14]}"
+
+@lru_cache(maxsize=None)
+def get_original_timestamp(file_path):
+    # Formatted mtime of the original file, or 'N/A' if it doesn't exist; cached so each path is stat'ed once per run
+    try:
+        st = os.stat(file_path)
+    except FileNotFoundError:
+        return 'N/A'
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(st.st_mtime))
+
+def parse_conflict(entry):
+    # Build a conflict namedtuple from a directory entry, or None if it isn't a usable conflict file
+    file = entry.name
+    # Match on the name before any stat so non-conflict files never touch the filesystem
+    match = RE_CONFLICT.fullmatch(file)
+    if not match:
+        return None
+
+    # Discard zero-length files (bad syncs)
+    st = entry.stat()
+    if st.st_size == 0:
+        return None
+    
+    # Extract timestamp from file name as a sortable YYYYMMDDHHMMSS string
+    date_str = match['date']  # YYYYMMDD
+    time_str = match['time']  # HHMMSS
+    ts_key = date_str + time_str
+    
+    # Create a conflict namedtuple
+    conflict_path = entry.path
+    
+    # Get the original filename with proper extension
+    file_name = match['base']
+    if match['ext']:
+        # Move the extension after the device identifier back onto the original name
+        file_name = f"{file_name}.{match['ext']}"
+    
+    file_path = os.path.join(os.path.dirname(conflict_path), file_name)
+
+    return conflict_item(conflict_path, file_path, ts_key)
+
+def scan(dir_path):
+    # Scan a single directory, returning the conflicts found in it and its subdirectories
+    conflicts = []
+    subdirs = []
+    try:
+        it = os.scandir(dir_path)
+    except OSError:
+        return conflicts, subdirs  # Unreadable directories are skipped, as os.walk did
+    with it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                conflict = parse_conflict(entry)
+                if conflict is not None:
+                    conflicts.append(conflict)
+    return conflicts, subdirs
+
+def collect_conflicts(path):
+    # Walk path, scanning directories concurrently to overlap filesystem latency
     conflict_files = []
-    for root, _, files in os.walk(args.path):
-        for file in files:
-            if re_conflict.match(file):
-                # Discard zero-length files (bad syncs)
-                if os.path.getsize(os.path.join(root, file)) == 0:
-                    continue
-                
-                # Extract timestamp from file name and convert to datetime object
-                match = re_timestamp.search(file)
-                if match:
-                    date_str = match.group(1)  # YYYYMMDD
-                    time_str = match.group(2)  # HHMMSS
-                    timestamp = datetime.strptime(f"{date_str} {time_str}", "%Y%m%d %H%M%S")
-                    
-                    # Create a conflict namedtuple and add to the list
-                    conflict_path = os.path.join(root, file)
-                    
-                    # Handle filenames with multiple extensions (e.g., file.txt.sync-conflict-...)
-                    base_name = os.path.basename(file)
-                    original_parts = base_name.split('.sync-conflict-')
-                    
-                    # Get the original filename with proper extension
-                    if len(original_parts) > 1:
-                        file_name = original_parts[0]
-                        # Check if there's an extension after the random identifier (XXXXX.extension)
-                        match_ext = re.search(r'[A-Z0-9]+\.(.+)$', original_parts[1])
-                        if match_ext:
-                            # Remove the extension from the conflict and use it for the original
-                            file_name = file_name
-                            
-                    file_path = os.path.join(root, file_name)
-
-                    conflict_files.append(conflict_item(conflict_path=conflict_path, file_path=file_path, timestamp=timestamp))
-
-    # Group conflicts by file_path
-    conflicts_by_path = {}
+    results = queue.Queue()  # Completed scan futures, handed back to this thread
+    max_workers = min(32, (os.cpu_count() or 1) * 4)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        executor.submit(scan, path).add_done_callback(results.put)
+        outstanding = 1
+        while outstanding:
+            conflicts, subdirs = results.get().result()
+            outstanding -= 1
+            conflict_files.extend(conflicts)
+            for subdir in subdirs:
+                executor.submit(scan, subdir).add_done_callback(results.put)
+            outstanding += len(subdirs)
+    return conflict_files
+
+def plan_actions(conflict_files, backup_dir, quiet=False):
+    # Decide what to do with each conflict: keep the newest per file, back up or delete the rest
+
+    # Group conflicts by file_path, tracking the newest conflict for each in a single pass
+    newest = {}  # file_path -> newest conflict
+    others = {}  # file_path -> older conflicts
     for conflict in conflict_files:
-        if conflict.file_path not in conflicts_by_path:
-            conflicts_by_path[conflict.file_path] = []
-        conflicts_by_path[conflict.file_path].append(conflict)
-    
-    # Sort each group by timestamp (newest first)
-    for file_path, conflicts in conflicts_by_path.items():
-        conflicts.sort(key=lambda x: x.timestamp, reverse=True)
+        current = newest.get(conflict.file_path)
+        if current is None or conflict.ts_key > current.ts_key:
+            if current is not None:
+                others.setdefault(conflict.file_path, []).append(current)
+            newest[conflict.file_path] = conflict
+        else:
+            others.setdefault(conflict.file_path, []).append(conflict)
     
     # Create a list of actions to perform
     actions = []
-    for file_path, conflicts in conflicts_by_path.items():
+    get_original_timestamp.cache_clear()  # Originals may have changed since a previous run
+    for file_path, newest_conflict in newest.items():
         # The newest conflict replaces the original file
-        newest_conflict = conflicts[0]
-        original_timestamp = 'N/A'
-        if os.path.exists(file_path):
-            original_timestamp = datetime.fromtimestamp(os.path.getmtime(file_path)).strftime('%Y-%m-%d %H:%M:%S')
+        # The original's time is only displayed, so skip probing it when the table isn't shown,
+        # or for a lone conflict in delete mode, which is a plain rename
+        if quiet or (file_path not in others and not backup_dir):
+            original_timestamp = '-'  # Not checked; 'N/A' means the original doesn't exist
+        else:
+            original_timestamp = get_original_timestamp(file_path)
         
         actions.append({
             'conflict': newest_conflict,
@@ -84,8 +135,8 @@ def main():
         })
         
         # Older conflicts either go to backup or get deleted
-        for conflict in conflicts[1:]:
-            if args.backup_dir:
+        for conflict in others.get(file_path, ()):
+            if backup_dir:
                 actions.append({
                     'conflict': conflict,
                     'action': ACTION_BACKUP,
@@ -98,6 +149,13 @@ def main():
                     'original_timestamp': original_timestamp
                 })
     
+    # Group actions by directory so renames and deletes in the same directory run back to back
+    actions.sort(key=lambda action_info: os.path.dirname(action_info['conflict'].conflict_path))
+    return actions
+
+def print_actions(actions):
+    # Print a table describing each action
+
     # Fixed widths for action and timestamps
     action_width = 10
     timestamp_width = 19
@@ -118,19 +176,16 @@ def main():
     header_format = f"{{:<{filename_width}}} | {{:<{action_width}}} | {{:<{timestamp_width}}} | {{:<{timestamp_width}}}"
     row_format = header_format  # Use same format for data rows
     
-    # Print header
-    print(header_format.format("Filename", "Action", "Original Time", "Conflict Time"))
-    
-    # Print separator line that matches header width exactly
+    # Header and separator line that matches header width exactly
     separator_width = filename_width + other_columns_width
-    print("-" * separator_width)
+    rows = [header_format.format("Filename", "Action", "Original Time", "Conflict Time"), "-" * separator_width]
     
-    # Process all actions
+    # Build a row for every action
     for action_info in actions:
         conflict = action_info['conflict']
         action_type = action_info['action']
         original_timestamp = action_info['original_timestamp']
-        conflict_timestamp = conflict.timestamp.strftime('%Y-%m-%d %H:%M:%S')
+        conflict_timestamp = fmt_ts(conflict.ts_key)
         
         # Get display action text
         if action_type == ACTION_KEEP:
@@ -145,26 +200,61 @@ def main():
         if len(filename) > filename_width:
             filename = "..." + filename[-(filename_width-3):]
         
-        # Print the row with all columns properly aligned
-        print(row_format.format(filename, action_text, original_timestamp, conflict_timestamp))
+        # Add the row with all columns properly aligned
+        rows.append(row_format.format(filename, action_text, original_timestamp, conflict_timestamp))
+    
+    # Print the whole table in a single write
+    sys.stdout.write("\n".join(rows) + "\n")
+    sys.stdout.flush()
+
+def apply_actions(actions, dry_run, backup_dir):
+    # Perform the actions unless this is a dry run
+    if dry_run:
+        return
+    
+    # Create backup directory once up front if it doesn't exist
+    if backup_dir:
+        os.makedirs(backup_dir, exist_ok=True)
+    
+    for action_info in actions:
+        conflict = action_info['conflict']
+        action_type = action_info['action']
         
-        # Perform the action if not in dry run mode
-        if not args.dry_run:
-            if action_type == ACTION_KEEP and os.path.exists(conflict.conflict_path):
-                os.rename(conflict.conflict_path, conflict.file_path)  # Rename conflict file to its original name
-            elif action_type == ACTION_DELETE and os.path.exists(conflict.conflict_path):
+        # Missing conflict files (e.g. removed since the scan) are skipped
+        try:
+            if action_type == ACTION_KEEP:
+                os.replace(conflict.conflict_path, conflict.file_path)  # Rename conflict file to its original name
+            elif action_type == ACTION_DELETE:
                 os.remove(conflict.conflict_path)  # Delete older conflict file
-            elif action_type == ACTION_BACKUP and os.path.exists(conflict.conflict_path):
-                # Create backup directory if it doesn't exist
-                if not os.path.exists(args.backup_dir):
-                    os.makedirs(args.backup_dir, exist_ok=True)
-                
+            elif action_type == ACTION_BACKUP:
                 # Create backup filename with timestamp to make it unique
                 backup_filename = os.path.basename(conflict.conflict_path)
-                backup_path = os.path.join(args.backup_dir, backup_filename)
+                backup_path = os.path.join(backup_dir, backup_filename)
                 
-                # Move the conflict file to backup directory
-                shutil.move(conflict.conflict_path, backup_path)
+                # Move the conflict file to backup directory, copying only if it's on another filesystem
+                try:
+                    os.replace(conflict.conflict_path, backup_path)
+                except OSError as e:
+                    if e.errno != errno.EXDEV:
+                        raise
+                    shutil.move(conflict.conflict_path, backup_path)
+        except FileNotFoundError:
+            pass
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Resolve Syncthing conflict files by keeping the most recent version.')
+    parser.add_argument('path', help='Path to search for conflict files')
+    parser.add_argument('--dry-run', action='store_true', help='Show what would be done without making any changes')
+    parser.add_argument('--backup-dir', help='Directory to move older conflict files to (if not provided, older conflicts will be deleted)')
+    parser.add_argument('--quiet', action='store_true', help="Don't print the table of actions")
+    args = parser.parse_args(argv)
+
+    # Walk provided path, get all files matching "\.sync-conflict-.*"
+    conflict_files = collect_conflicts(args.path)
+    actions = plan_actions(conflict_files, args.backup_dir, args.quiet)
+    if not args.quiet:
+        print_actions(actions)
+    apply_actions(actions, args.dry_run, args.backup_dir)
 
 
 if __name__ == '__main__':